@@ -1,15 +1,23 @@
 import sys 
 import json
 import os
+import time
+
+# Taken before the imports so a relative budget covers them too
+START_TIME = time.time()
+
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.ensemble import GradientBoostingRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 import traceback
 
+# Below this much remaining budget the model is not trained at all
+ML_MIN_BUDGET_MS = 1500
+# Budget kept aside for ranking and output if training overruns
+RANKING_RESERVE_MS = 200
+# A model cut short by the deadline is still served if it has this many stages
+ML_MIN_STAGES = 20
+
 try:
     # -------------------- 0. Read user profile --------------------
     user_profile = json.loads(sys.stdin.read())
@@ -27,6 +35,22 @@ try:
     user_profile["allergies"] = allergies_list
     print(f"[DEBUG] Processed allergies: {user_profile['allergies']}", file=sys.stderr)
 
+    # ⏱️ Optional deadline: absolute epoch ms from the caller, or a budget in ms
+    # counted from process start (neither = always use the model)
+    deadline_ms = user_profile.pop("deadline_ms", None)
+    latency_budget_ms = user_profile.pop("latency_budget_ms", None)
+    if deadline_ms:
+        deadline = float(deadline_ms) / 1000
+    elif latency_budget_ms:
+        deadline = START_TIME + float(latency_budget_ms) / 1000
+    else:
+        deadline = None
+
+    def remaining_ms():
+        if deadline is None:
+            return float("inf")
+        return (deadline - time.time()) * 1000
+
     # -------------------- 1. History management --------------------
     HISTORY_DIR = "history"
     os.makedirs(HISTORY_DIR, exist_ok=True)
@@ -64,7 +88,7 @@ try:
         df_food = pd.read_csv("E:/DIET APP/backend/ML/datasets/preprocessed_dataset.csv")
 
     # -------------------- 3. Compute fitness --------------------
-    def compute_fitness(food, profile):
+    def compute_fitness(df, profile):
         try:
             TDEE = profile.get("TDEE", 2000)
             protein_g = profile.get("protein_g", 50)
@@ -76,52 +100,89 @@ try:
                 "carb_g": carb_g / 4,
                 "fat_g": fat_g / 4
             }
-            energy_score = 1 - abs(food["energy_kcal"] - targets["energy_kcal"]) / targets["energy_kcal"]
-            protein_score = 1 - abs(food["protein_g"] - targets["protein_g"]) / targets["protein_g"]
-            carb_score = 1 - abs(food["carb_g"] - targets["carb_g"]) / targets["carb_g"]
-            fat_score = 1 - abs(food["fat_g"] - targets["fat_g"]) / targets["fat_g"]
-            health_score = food.get("health_score", 50) / 100
-            nutrient_score = food.get("nutrient_score", 50) / 100
+            energy_score = 1 - (df["energy_kcal"] - targets["energy_kcal"]).abs() / targets["energy_kcal"]
+            protein_score = 1 - (df["protein_g"] - targets["protein_g"]).abs() / targets["protein_g"]
+            carb_score = 1 - (df["carb_g"] - targets["carb_g"]).abs() / targets["carb_g"]
+            fat_score = 1 - (df["fat_g"] - targets["fat_g"]).abs() / targets["fat_g"]
+            health_score = df["health_score"].fillna(50) / 100 if "health_score" in df else 0.5
+            nutrient_score = df["nutrient_score"].fillna(50) / 100 if "nutrient_score" in df else 0.5
             fitness = (0.3*energy_score + 0.2*protein_score + 0.2*carb_score +
                        0.1*fat_score + 0.1*health_score + 0.1*nutrient_score)
-            return fitness
+            return fitness.fillna(0.5)
         except Exception as e:
-            print(f"[ERROR] compute_fitness failed for {food['food_name']}: {e}", file=sys.stderr)
-            return 0.5
+            print(f"[ERROR] compute_fitness failed: {e}", file=sys.stderr)
+            return pd.Series(0.5, index=df.index)
 
-    df_food["fitness_target"] = df_food.apply(lambda x: compute_fitness(x, user_profile), axis=1)
+    df_food["fitness_target"] = compute_fitness(df_food, user_profile)
     print(f"[DEBUG] Computed fitness for {len(df_food)} foods", file=sys.stderr)
 
-    # -------------------- 4. Prepare features --------------------
+    # -------------------- 4. Choose serving path --------------------
+    # Train the model only if it fits the latency budget, otherwise rank
+    # directly by the rule-based fitness over the same filters
     drop_cols = ["food_id", "food_name", "allergies", "allergy_list"]
-    X = df_food.drop(columns=drop_cols + ["fitness_target"])
-    bool_cols = X.select_dtypes(include=["bool"]).columns
-    X[bool_cols] = X[bool_cols].astype(int)
-    cat_cols = X.select_dtypes(include=["object"]).columns
-    X = pd.get_dummies(X, columns=cat_cols, drop_first=True)
-    y = df_food["fitness_target"]
-    scaler = MinMaxScaler()
-    X_scaled = pd.DataFrame(scaler.fit_transform(X), columns=X.columns)
-
-    # -------------------- 5. Train model & Evaluate --------------------
-    X_train, X_test, y_train, y_test = train_test_split(X_scaled, y, test_size=0.2, random_state=42)
-    model = GradientBoostingRegressor()
-    model.fit(X_train, y_train)
-    print("[DEBUG] Model trained successfully", file=sys.stderr)
-
-    # ✅ Evaluation metrics (printed only in terminal)
-    y_pred = model.predict(X_test)
-    mae = mean_absolute_error(y_test, y_pred)
-    mse = mean_squared_error(y_test, y_pred)
-    rmse = np.sqrt(mse)
-    r2 = r2_score(y_test, y_pred)
-
-    print("\n[MODEL PERFORMANCE METRICS]", file=sys.stderr)
-    print(f"MAE  (Mean Absolute Error): {mae:.6f}", file=sys.stderr)
-    print(f"MSE  (Mean Squared Error): {mse:.6f}", file=sys.stderr)
-    print(f"RMSE (Root Mean Squared Error): {rmse:.6f}", file=sys.stderr)
-    print(f"R²   (R-squared): {r2:.6f}", file=sys.stderr)
-    print("-----------------------------------------------------------", file=sys.stderr)
+    model = None
+    served_by = "rule_based"
+    if remaining_ms() < ML_MIN_BUDGET_MS:
+        print(f"[DEBUG] {remaining_ms():.0f} ms of budget left, skipping model training", file=sys.stderr)
+    else:
+        # -------------------- 5. Prepare features & train model --------------------
+        # sklearn is imported here so the rule-based path doesn't pay for it
+        from sklearn.preprocessing import MinMaxScaler
+        from sklearn.ensemble import GradientBoostingRegressor
+        from sklearn.model_selection import train_test_split
+        from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+
+        X = df_food.drop(columns=drop_cols + ["fitness_target"])
+        bool_cols = X.select_dtypes(include=["bool"]).columns
+        X[bool_cols] = X[bool_cols].astype(int)
+        cat_cols = X.select_dtypes(include=["object"]).columns
+        X = pd.get_dummies(X, columns=cat_cols, drop_first=True)
+        y = df_food["fitness_target"]
+        scaler = MinMaxScaler()
+        X_scaled = pd.DataFrame(scaler.fit_transform(X), columns=X.columns)
+
+        X_train, X_test, y_train, y_test = train_test_split(X_scaled, y, test_size=0.2, random_state=42)
+        model = GradientBoostingRegressor()
+
+        # ⏱️ Stop boosting as soon as the deadline is about to pass
+        training = {"stopped_at": None}
+
+        def deadline_monitor(i, est, env):
+            if remaining_ms() < RANKING_RESERVE_MS:
+                training["stopped_at"] = i + 1  # stages fitted so far
+                return True
+            return False
+
+        model.fit(X_train, y_train, monitor=deadline_monitor)
+
+        if training["stopped_at"] is not None and training["stopped_at"] < ML_MIN_STAGES:
+            print(f"[DEBUG] Training stopped after {training['stopped_at']} stages, "
+                  "falling back to rule-based ranking", file=sys.stderr)
+            model = None
+        elif training["stopped_at"] is not None:
+            # Keep the truncated ensemble rather than throwing the work away
+            served_by = "ml_truncated"
+            print(f"[DEBUG] Training stopped after {training['stopped_at']} stages, "
+                  "serving truncated model", file=sys.stderr)
+        else:
+            served_by = "ml"
+            print("[DEBUG] Model trained successfully", file=sys.stderr)
+
+            # ✅ Evaluation metrics (printed only in terminal)
+            y_pred = model.predict(X_test)
+            mae = mean_absolute_error(y_test, y_pred)
+            mse = mean_squared_error(y_test, y_pred)
+            rmse = np.sqrt(mse)
+            r2 = r2_score(y_test, y_pred)
+
+            print("\n[MODEL PERFORMANCE METRICS]", file=sys.stderr)
+            print(f"MAE  (Mean Absolute Error): {mae:.6f}", file=sys.stderr)
+            print(f"MSE  (Mean Squared Error): {mse:.6f}", file=sys.stderr)
+            print(f"RMSE (Root Mean Squared Error): {rmse:.6f}", file=sys.stderr)
+            print(f"R²   (R-squared): {r2:.6f}", file=sys.stderr)
+            print("-----------------------------------------------------------", file=sys.stderr)
+
+    print(f"[DEBUG] Serving recommendations via {served_by} path", file=sys.stderr)
 
     # -------------------- 6. Recommendation function --------------------
     def recommend_top_foods(profile, df_food, model, meal_type=None):
@@ -132,17 +193,20 @@ try:
             if df.empty:
                 return pd.DataFrame(columns=["food_name", "predicted_fitness"])
 
-            X_input = df.drop(columns=drop_cols + ["fitness_target"])
-            bool_cols_input = X_input.select_dtypes(include=["bool"]).columns
-            X_input[bool_cols_input] = X_input[bool_cols_input].astype(int)
-            cat_cols_input = X_input.select_dtypes(include=["object"]).columns
-            X_input = pd.get_dummies(X_input, columns=cat_cols_input, drop_first=True)
-            for col in X_scaled.columns:
-                if col not in X_input.columns:
-                    X_input[col] = 0
-            X_input = X_input[X_scaled.columns]
+            if model is None:
+                df["predicted_fitness"] = df["fitness_target"]
+            else:
+                X_input = df.drop(columns=drop_cols + ["fitness_target"])
+                bool_cols_input = X_input.select_dtypes(include=["bool"]).columns
+                X_input[bool_cols_input] = X_input[bool_cols_input].astype(int)
+                cat_cols_input = X_input.select_dtypes(include=["object"]).columns
+                X_input = pd.get_dummies(X_input, columns=cat_cols_input, drop_first=True)
+                for col in X_scaled.columns:
+                    if col not in X_input.columns:
+                        X_input[col] = 0
+                X_input = X_input[X_scaled.columns]
 
-            df["predicted_fitness"] = model.predict(X_input)
+                df["predicted_fitness"] = model.predict(X_input)
 
             allergy_map = {
                 "Milk": "contains_milk", "Egg": "contains_egg", "Peanut": "contains_peanut",
@@ -190,7 +254,7 @@ try:
     save_history(history)
 
     # -------------------- 9. Output --------------------
-    output = {"meals": meals, "history": history}
+    output = {"meals": meals, "history": history, "served_by": served_by}
     print(json.dumps(output))
 
 except Exception as e:
@@ -1,9 +1,24 @@
 const express = require("express");
 const router = express.Router();
-const { spawn } = require("child_process");
 const jwt = require("jsonwebtoken");
-const path = require("path");
 const Profile = require("../models/Profile"); // ensure correct path
+const recommendationService = require("../services/recommendationService");
+
+const RETRY_AFTER_SECONDS = Number(process.env.ML_RETRY_AFTER_SECONDS) || 2;
+
+// ⏱️ Latency budget: the server's ML_LATENCY_BUDGET_MS is the maximum, a client
+// may only ask for a shorter (finite, positive) one. Budgets are raised to the
+// service's minimum run time so a short one degrades instead of timing out.
+function resolveLatencyBudget(requested) {
+  const serverBudget = Number(process.env.ML_LATENCY_BUDGET_MS);
+  const maxBudget = Number.isFinite(serverBudget) && serverBudget > 0 ? serverBudget : null;
+  const value = Number(requested);
+  const budget =
+    requested == null || !Number.isFinite(value) || value <= 0
+      ? maxBudget
+      : maxBudget ? Math.min(value, maxBudget) : value;
+  return budget ? Math.max(budget, recommendationService.minTimeoutMs) : null;
+}
 
 // -------------------- AUTH MIDDLEWARE --------------------
 function authMiddleware(req, res, next) {
@@ -52,89 +67,64 @@ router.post("/", authMiddleware, async (req, res) => {
       goals: profileData.goals || null,
     };
 
-    console.log("[DEBUG] Cleaned profile data to send to Python:", cleanedProfile);
-
-    // 3️⃣ Prepare Python script path
-    const scriptPath = path.join(__dirname, "../ML/model/ml_model.py");
-    console.log("[DEBUG] Python script path:", scriptPath);
-
-    // 4️⃣ Spawn Python process
-    const py = spawn("python", [scriptPath]);
-
-    let pythonOutput = "";
-    let pythonError = "";
-
-    // ✅ Capture stdout and stderr
-    py.stdout.on("data", (data) => {
-      pythonOutput += data.toString();
-      console.log("[PYTHON STDOUT]", data.toString());
-    });
-
-    py.stderr.on("data", (data) => {
-      pythonError += data.toString();
-      console.error("[PYTHON STDERR]", data.toString());
-    });
-
-    // ✅ Handle Python exit correctly
-    py.on("close", async (code) => {
-      console.log(`[PYTHON EXIT] Code: ${code}`);
+    // Absolute deadline so spawn, imports and queueing all count against the budget;
+    // Python falls back to rule-based ranking if the model won't fit
+    const latencyBudgetMs = resolveLatencyBudget(req.body?.latency_budget_ms);
+    const deadline = latencyBudgetMs ? Date.now() + latencyBudgetMs : null;
 
-      if (code === 0 && pythonOutput) {
-        try {
-          const parsedOutput = JSON.parse(pythonOutput.trim());
-          console.log("[DEBUG] Parsed Python output:", parsedOutput);
-
-          const meals = parsedOutput.meals || {};
-          const history = parsedOutput.history || {};
+    console.log("[DEBUG] Cleaned profile data to send to Python:", cleanedProfile);
 
-          // ✅ Save prediction to MongoDB
-          profile.predictions.push({
-            user: profile.user,
-            meals,
-            date: new Date(),
-          });
-          await profile.save();
-          console.log("[DEBUG] Saved new prediction to profile");
+    // 3️⃣ Save prediction to MongoDB; runs once per computation and the saved
+    // predictions are shared with coalesced duplicates
+    const persist = async (output) => {
+      profile.predictions.push({
+        user: profile.user,
+        meals: output.meals || {},
+        date: new Date(),
+      });
+      await profile.save();
+      console.log("[DEBUG] Saved new prediction to profile");
+      return profile.predictions;
+    };
 
-          return res.status(200).json({
-            success: true,
-            message: "Prediction successful",
-            meals,
-            history,
-            predictions: profile.predictions,
-          });
-        } catch (parseErr) {
-          console.error("[PARSE ERROR] Could not parse Python output:", parseErr);
-          return res.status(500).json({
-            success: false,
-            msg: "Failed to parse Python output.",
-            error: parseErr.message,
-            rawOutput: pythonOutput.trim(),
-          });
-        }
-      } else {
-        console.error("[ML ERROR]", pythonError || "Python execution failed");
-        return res.status(500).json({
+    // 4️⃣ Run the recommender (queued, coalesced with identical in-flight requests)
+    let result;
+    try {
+      result = await recommendationService.recommend(cleanedProfile, { deadline, persist });
+    } catch (mlErr) {
+      if (!mlErr.code) throw mlErr; // not from the recommender, e.g. the save failed
+      if (mlErr.code === "QUEUE_FULL" || mlErr.code === "DEADLINE_EXCEEDED") {
+        console.warn(`[ML BUSY] ${mlErr.code}`, recommendationService.stats());
+        res.set("Retry-After", String(RETRY_AFTER_SECONDS));
+        return res.status(503).json({
           success: false,
-          msg: "Python execution failed.",
-          stderr: pythonError,
-          stdout: pythonOutput,
+          msg: mlErr.message,
+          ...mlErr.details,
         });
       }
-    });
-
-    // ✅ Send data to Python script
-    py.stdin.write(JSON.stringify(cleanedProfile));
-    py.stdin.end();
-
-    // ✅ Handle spawn errors
-    py.on("error", (err) => {
-      console.error("[PYTHON SPAWN ERROR]", err);
-      return res.status(500).json({
+      console.error("[ML ERROR]", mlErr.details?.stderr || mlErr.message);
+      return res.status(mlErr.code === "TIMEOUT" ? 504 : 500).json({
         success: false,
-        msg: "Could not execute the ML script.",
-        error: err.message,
+        msg: mlErr.message,
+        ...mlErr.details,
       });
+    }
+
+    const parsedOutput = result.output;
+    console.log("[DEBUG] Parsed Python output:", parsedOutput, result.coalesced ? "(coalesced)" : "");
+
+    const meals = parsedOutput.meals || {};
+    const history = parsedOutput.history || {};
+    const servedBy = parsedOutput.served_by || "unknown";
+    console.log("[DEBUG] Recommendations served by:", servedBy);
+
+    return res.status(200).json({
+      success: true,
+      message: "Prediction successful",
+      meals,
+      history,
+      servedBy,
+      predictions: result.saved,
     });
   } catch (err) {
     console.error("[SERVER ERROR]", err);
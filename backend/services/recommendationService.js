@@ -0,0 +1,232 @@
+// backend/services/recommendationService.js
+const { spawn } = require("child_process");
+const os = require("os");
+const path = require("path");
+
+const SCRIPT_PATH = path.join(__dirname, "../ML/model/ml_model.py");
+const PYTHON_COMMAND = ["python", SCRIPT_PATH];
+// Time a killed run gets to exit on SIGTERM before it is sent SIGKILL
+const KILL_GRACE_MS = 2000;
+
+// Error carrying the details the route needs to build its response
+class RecommendationError extends Error {
+  constructor(code, message, details = {}) {
+    super(message);
+    this.code = code;
+    this.details = details;
+  }
+}
+
+class RecommendationService {
+  constructor({
+    maxConcurrent = Number(process.env.ML_MAX_CONCURRENCY) ||
+      (os.availableParallelism ? os.availableParallelism() : os.cpus().length),
+    maxQueue = Number(process.env.ML_MAX_QUEUE),
+    // Hard limit for runs without a deadline, and extra time past a deadline
+    // before a run is killed
+    timeoutMs = Number(process.env.ML_TIMEOUT_MS) || 60000,
+    timeoutGraceMs = Number(process.env.ML_TIMEOUT_GRACE_MS) || 2000,
+    // Never kill sooner than a cold rule-based run takes (interpreter start,
+    // pandas import, CSV read, history write)
+    minTimeoutMs = Number(process.env.ML_MIN_TIMEOUT_MS) || 5000,
+    command = PYTHON_COMMAND,
+  } = {}) {
+    this.maxConcurrent = Math.max(1, maxConcurrent);
+    this.maxQueue = Number.isFinite(maxQueue) && maxQueue >= 0 ? maxQueue : this.maxConcurrent * 2;
+    this.queue = [];            // jobs waiting for a free slot
+    this.inFlight = new Map();  // request key -> job (queued or running)
+    this.runningUsers = new Set();
+    this.running = 0;
+    this.timeoutMs = timeoutMs;
+    this.timeoutGraceMs = timeoutGraceMs;
+    this.minTimeoutMs = minTimeoutMs;
+    this.command = command;
+  }
+
+  // Run the recommender for a profile, optionally by an absolute deadline
+  // (epoch ms). The deadline is not part of the coalescing key.
+  // persist(output) runs once per computation and its result is shared as
+  // `saved` with every coalesced request.
+  // Resolves with { output, saved, coalesced } where coalesced is true if the
+  // result was shared with an identical request that was already in flight.
+  recommend(profile, { deadline = null, persist = null } = {}) {
+    const key = JSON.stringify(profile);
+    const existing = this.inFlight.get(key);
+    if (existing) {
+      console.log("[RECOMMEND] Coalescing request for user:", profile.user_id);
+      return existing.promise.then((result) => ({ ...result, coalesced: true }));
+    }
+
+    const job = { key, profile, deadline, persist, enqueuedAt: Date.now() };
+    job.promise = new Promise((resolve, reject) => {
+      job.resolve = resolve;
+      job.reject = reject;
+    });
+    // Registered before dispatching so a job rejected straight away (expired
+    // deadline) is removed again instead of being left for others to join
+    this.inFlight.set(key, job);
+    this.queue.push(job);
+    this._dispatch();
+
+    // ⛔ Back-pressure: refuse work that can neither start nor wait in the
+    // bounded queue instead of oversubscribing the machine
+    if (this.queue.length > this.maxQueue && this.queue.includes(job)) {
+      this.queue.splice(this.queue.indexOf(job), 1);
+      this.inFlight.delete(key);
+      return Promise.reject(
+        new RecommendationError("QUEUE_FULL", "Recommendation service is busy, try again shortly.", {
+          queued: this.queue.length,
+          running: this.running,
+        })
+      );
+    }
+    return job.promise.then((result) => ({ ...result, coalesced: false }));
+  }
+
+  stats() {
+    return {
+      running: this.running,
+      queued: this.queue.length,
+      maxConcurrent: this.maxConcurrent,
+      maxQueue: this.maxQueue,
+    };
+  }
+
+  // Start queued jobs while slots are free, never running two jobs for the
+  // same user at once since they share the same history file
+  _dispatch() {
+    while (this.running < this.maxConcurrent) {
+      const index = this.queue.findIndex((job) => !this.runningUsers.has(job.profile.user_id));
+      if (index === -1) return;
+      const [job] = this.queue.splice(index, 1);
+      const waitedMs = Date.now() - job.enqueuedAt;
+
+      // ⏱️ The deadline is absolute, so queueing time is already taken off
+      // the budget; a job whose deadline passed while queued is not started
+      if (job.deadline && Date.now() >= job.deadline) {
+        console.warn(`[RECOMMEND] Deadline passed after ${waitedMs} ms in queue for user:`, job.profile.user_id);
+        this.inFlight.delete(job.key);
+        job.reject(
+          new RecommendationError("DEADLINE_EXCEEDED", "Recommendation service is busy, try again shortly.", {
+            waitedMs,
+          })
+        );
+        continue;
+      }
+
+      this.running++;
+      this.runningUsers.add(job.profile.user_id);
+      const run = this._run(job.profile, job.deadline);
+      const settled = run.result
+        .then(async (output) => ({
+          output,
+          saved: job.persist ? await job.persist(output) : undefined,
+        }))
+        .then(job.resolve, job.reject)
+        .finally(() => this.inFlight.delete(job.key));
+
+      // The slot and user lock are held until the process has exited, so a
+      // killed run can't still be writing the history file when the next
+      // run for that user starts
+      Promise.all([settled, run.exited]).then(() => {
+        this.running--;
+        this.runningUsers.delete(job.profile.user_id);
+        this._dispatch();
+      });
+    }
+  }
+
+  // Returns { result, exited }: result settles with the parsed output (or is
+  // rejected early on timeout), exited resolves once the process is gone
+  _run(profile, deadline) {
+    const [cmd, ...args] = this.command;
+    const py = spawn(cmd, args);
+    const exited = new Promise((resolve) => {
+      py.on("close", resolve);
+      py.on("error", resolve);
+    });
+
+    const result = new Promise((resolve, reject) => {
+      let pythonOutput = "";
+      let pythonError = "";
+      let settled = false;
+
+      // ⛔ Hard timeout so a hung run cannot hold its slot forever
+      const timeoutMs = deadline
+        ? Math.max(deadline - Date.now() + this.timeoutGraceMs, this.minTimeoutMs)
+        : this.timeoutMs;
+      const timer = setTimeout(() => {
+        if (settled) return;
+        settled = true;
+        console.error(`[PYTHON TIMEOUT] Killing run after ${timeoutMs} ms`);
+        py.kill();
+        const forceKill = setTimeout(() => py.kill("SIGKILL"), KILL_GRACE_MS);
+        exited.then(() => clearTimeout(forceKill));
+        reject(
+          new RecommendationError("TIMEOUT", "Recommendation took too long.", {
+            timeoutMs,
+            stderr: pythonError,
+          })
+        );
+      }, timeoutMs);
+
+      py.stdout.on("data", (data) => {
+        pythonOutput += data.toString();
+        console.log("[PYTHON STDOUT]", data.toString());
+      });
+
+      py.stderr.on("data", (data) => {
+        pythonError += data.toString();
+        console.error("[PYTHON STDERR]", data.toString());
+      });
+
+      py.on("close", (code) => {
+        console.log(`[PYTHON EXIT] Code: ${code}`);
+        clearTimeout(timer);
+        if (settled) return;
+        settled = true;
+
+        if (code !== 0 || !pythonOutput) {
+          return reject(
+            new RecommendationError("PYTHON_FAILED", "Python execution failed.", {
+              stderr: pythonError,
+              stdout: pythonOutput,
+            })
+          );
+        }
+        try {
+          resolve(JSON.parse(pythonOutput.trim()));
+        } catch (parseErr) {
+          reject(
+            new RecommendationError("PARSE_FAILED", "Failed to parse Python output.", {
+              error: parseErr.message,
+              rawOutput: pythonOutput.trim(),
+            })
+          );
+        }
+      });
+
+      py.on("error", (err) => {
+        console.error("[PYTHON SPAWN ERROR]", err);
+        clearTimeout(timer);
+        if (settled) return;
+        settled = true;
+        reject(
+          new RecommendationError("SPAWN_FAILED", "Could not execute the ML script.", {
+            error: err.message,
+          })
+        );
+      });
+
+      py.stdin.on("error", () => {}); // reported through "error"/"close" instead
+      py.stdin.write(JSON.stringify({ ...profile, deadline_ms: deadline }));
+      py.stdin.end();
+    });
+
+    return { result, exited };
+  }
+}
+
+module.exports = new RecommendationService();
+module.exports.RecommendationService = RecommendationService;
+module.exports.RecommendationError = RecommendationError;
@@ -0,0 +1,170 @@
+// backend/test/recommendationService.test.js
+// Run with: npm test (node --test)
+const test = require("node:test");
+const assert = require("node:assert");
+const { RecommendationService } = require("../services/recommendationService");
+
+// Service whose runs are settled by hand instead of spawning Python
+function stubbedService(options) {
+  const service = new RecommendationService({ maxConcurrent: 1, maxQueue: 1, ...options });
+  service.runs = [];
+  service._run = (profile, deadline) => {
+    const result = new Promise((resolve, reject) =>
+      service.runs.push({ profile, deadline, resolve, reject })
+    );
+    return { result, exited: result.catch(() => {}) };
+  };
+  return service;
+}
+
+const tick = () => new Promise((resolve) => setImmediate(resolve));
+
+test("coalesces identical requests, including onto a queued job", async () => {
+  const service = stubbedService();
+  let persisted = 0;
+  const persist = async () => ++persisted;
+
+  const first = service.recommend({ user_id: "u1" }, { persist });
+  const queued = service.recommend({ user_id: "u2" }, { persist });
+  const duplicate = service.recommend({ user_id: "u2" }, { persist });
+  assert.deepStrictEqual(service.stats().queued, 1);
+
+  service.runs[0].resolve({ meals: "a" });
+  await first;
+  await tick();
+  service.runs[1].resolve({ meals: "b" });
+
+  const [a, b] = await Promise.all([queued, duplicate]);
+  assert.strictEqual(service.runs.length, 2);
+  assert.strictEqual(persisted, 2);
+  assert.strictEqual(a.coalesced, false);
+  assert.strictEqual(b.coalesced, true);
+  assert.strictEqual(a.saved, b.saved);
+});
+
+test("runs one job per user at a time and lets other users skip ahead", async () => {
+  const service = stubbedService({ maxConcurrent: 2, maxQueue: 2 });
+
+  service.recommend({ user_id: "u1" });
+  service.recommend({ user_id: "u1", goals: "other" });
+  service.recommend({ user_id: "u2" });
+
+  assert.deepStrictEqual(service.runs.map((run) => run.profile.user_id), ["u1", "u2"]);
+  assert.strictEqual(service.stats().queued, 1);
+
+  service.runs[0].resolve({});
+  await tick();
+  await tick();
+  assert.deepStrictEqual(service.runs.map((run) => run.profile.user_id), ["u1", "u2", "u1"]);
+});
+
+test("rejects with QUEUE_FULL only when a job can neither start nor wait", async () => {
+  const service = stubbedService({ maxConcurrent: 2, maxQueue: 1 });
+
+  service.recommend({ user_id: "u1" });
+  service.recommend({ user_id: "u1", goals: "other" }); // waits for u1
+  service.recommend({ user_id: "u2" }); // free slot, starts
+  await assert.rejects(service.recommend({ user_id: "u3" }), { code: "QUEUE_FULL" });
+  assert.strictEqual(service.runs.length, 2);
+});
+
+test("releases the slot when a run fails", async () => {
+  const service = stubbedService();
+
+  const failing = service.recommend({ user_id: "u1" });
+  const next = service.recommend({ user_id: "u2" });
+  service.runs[0].reject(new Error("boom"));
+  await assert.rejects(failing, /boom/);
+  await tick();
+
+  assert.strictEqual(service.runs.length, 2);
+  service.runs[1].resolve({});
+  await next;
+  await tick();
+  assert.deepStrictEqual(service.stats().running, 0);
+});
+
+test("does not start jobs whose deadline passed while queued", async () => {
+  const service = stubbedService();
+
+  service.recommend({ user_id: "u1" });
+  const expired = service.recommend({ user_id: "u2" }, { deadline: Date.now() + 5 });
+  await new Promise((resolve) => setTimeout(resolve, 10));
+  service.runs[0].resolve({});
+
+  await assert.rejects(expired, { code: "DEADLINE_EXCEEDED" });
+  assert.strictEqual(service.runs.length, 1);
+});
+
+test("an already-expired deadline does not block later identical requests", async () => {
+  const service = stubbedService();
+
+  await assert.rejects(service.recommend({ user_id: "u1" }, { deadline: Date.now() - 1 }), {
+    code: "DEADLINE_EXCEEDED",
+  });
+  assert.strictEqual(service.inFlight.size, 0);
+
+  const retry = service.recommend({ user_id: "u1" }, { deadline: Date.now() + 60000 });
+  assert.strictEqual(service.runs.length, 1);
+  service.runs[0].resolve({});
+  assert.strictEqual((await retry).coalesced, false);
+});
+
+test("a rejected QUEUE_FULL request is not joined by later identical requests", async () => {
+  const service = stubbedService({ maxQueue: 0 });
+
+  service.recommend({ user_id: "u1" });
+  await assert.rejects(service.recommend({ user_id: "u2" }), { code: "QUEUE_FULL" });
+  assert.strictEqual(service.inFlight.size, 1);
+});
+
+test("passes the deadline to the child without making it part of the coalescing key", async () => {
+  const echo = "let s='';process.stdin.on('data',d=>s+=d).on('end',()=>console.log(s))";
+  const service = new RecommendationService({ command: [process.execPath, "-e", echo] });
+  const deadline = Date.now() + 5000;
+
+  const [a, b] = await Promise.all([
+    service.recommend({ user_id: "u1" }, { deadline }),
+    service.recommend({ user_id: "u1" }, { deadline: deadline + 1000 }),
+  ]);
+  assert.strictEqual(a.output.deadline_ms, deadline);
+  assert.strictEqual(b.coalesced, true);
+});
+
+test("kills a hung run after the timeout and frees its slot once it has exited", async () => {
+  const service = new RecommendationService({
+    maxConcurrent: 1,
+    timeoutMs: 100,
+    command: [process.execPath, "-e", "setInterval(() => {}, 1000)"],
+  });
+
+  await assert.rejects(service.recommend({ user_id: "u1" }), { code: "TIMEOUT" });
+  assert.strictEqual(service.stats().running, 1);
+  await new Promise((resolve) => setTimeout(resolve, 200));
+  assert.strictEqual(service.stats().running, 0);
+});
+
+test("escalates to SIGKILL when a killed run ignores SIGTERM", async () => {
+  const service = new RecommendationService({
+    maxConcurrent: 1,
+    timeoutMs: 1000, // long enough for the child to install its SIGTERM handler
+    command: [process.execPath, "-e", "process.on('SIGTERM', () => {}); setInterval(() => {}, 1000)"],
+  });
+
+  await assert.rejects(service.recommend({ user_id: "u1" }), { code: "TIMEOUT" });
+  await new Promise((resolve) => setTimeout(resolve, 500));
+  assert.strictEqual(service.stats().running, 1);
+  await new Promise((resolve) => setTimeout(resolve, 2000));
+  assert.strictEqual(service.stats().running, 0);
+});
+
+test("gives a run with a short deadline at least the minimum timeout", async () => {
+  const service = new RecommendationService({
+    timeoutGraceMs: 0,
+    minTimeoutMs: 1000,
+    command: [process.execPath, "-e", "setTimeout(() => console.log('{}'), 200)"],
+  });
+
+  const result = await service.recommend({ user_id: "u1" }, { deadline: Date.now() + 1 });
+  assert.deepStrictEqual(result.output, {});
+});